@@ -101,7 +101,7 @@ def chk_xpath_expr(ctx, mod, pos, initial, node, q, t):
             chk_xpath_path(ctx, mod, pos, initial, node, q[1])
         elif q[0] == 'union':
             for qa in q[1]:
-                chk_xpath_path(ctx, mod, pos, initial, node, qa)
+                chk_xpath_expr(ctx, mod, pos, initial, node, qa, None)
         elif q[0] == 'comp':
             chk_xpath_expr(ctx, mod, pos, initial, node, q[2], None)
             chk_xpath_expr(ctx, mod, pos, initial, node, q[3], None)
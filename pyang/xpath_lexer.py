@@ -1,6 +1,6 @@
 """XPath 1.0 lexer / scanner
 
-Used with the PLY-based parser xpath_parser.py.
+Used with the parser in xpath_parser.py.
 
 See http://www.w3.org/TR/1999/REC-xpath-19991116
 """
@@ -14,6 +14,8 @@ class XPathError(Exception):
         self.pos = pos
 
 class XPathTok(object):
+    __slots__ = ('type', 'value', 'lineno', 'lexpos')
+
     def __init__(self, t, v, line, pos):
         self.type = t
         self.value = v
@@ -23,18 +25,18 @@ class XPathTok(object):
 class XPathLexer(object):
     def input(self, s):
         self.toks = []
+        self.i = 0
         self.error = None
         try:
-            self.toks = scan(s)
+            self.toks = scan(s, keep_whitespace=False)
         except SyntaxError as e:
             self.error = e
 
     def token(self):
-        while len(self.toks) > 0:
-            tok = self.toks[0]
-            self.toks = self.toks[1:]
-            if tok.type != '_whitespace':
-                return tok
+        if self.i < len(self.toks):
+            tok = self.toks[self.i]
+            self.i += 1
+            return tok
 
         if self.error is not None:
             raise self.error
@@ -44,44 +46,48 @@ class XPathLexer(object):
 # not 100% XPath / XML, but good enough for YANG
 namestr=r'[a-zA-Z_][a-zA-Z0-9_\-.]*'
 ncnamestr = '((' + namestr + '):)?(' + namestr + ')'
-prefixteststr = '((' + namestr + r'):)?\*'
 
 re_ncname = re.compile(ncnamestr)
+re_number = re.compile(r'[0-9]+(\.[0-9]+)?')
+re_whitespace = re.compile(r'\s+')
+
+# punctuation and operator tokens are looked up directly on the input
+# characters; two-character tokens must be tried first
+two_char_tokens = {
+    '..': 'DOTDOT',
+    '::': 'DOUBLECOLON',
+    '//': 'DOUBLESLASH',
+    '!=': 'NEQ',
+    '<=': 'LTE',
+    '>=': 'GTE',
+}
 
-patterns = [
-    # special token used when we need to preserve whitespace,
-    # not used in normal parsing
-    ('_whitespace', re.compile(r'\s+')),
-    # Expr tokens
-    ('LPAREN', re.compile(r'\(')),
-    ('RPAREN', re.compile(r'\)')),
-    ('LBRACKET', re.compile(r'\[')),
-    ('RBRACKET', re.compile(r'\]')),
-    ('DOTDOT', re.compile(r'\.\.')),
-    ('DOT', re.compile(r'\.')),
-    ('COMMA', re.compile(r'\,')),
-    ('AT', re.compile(r'\@')),
-    ('DOLLAR', re.compile(r'\$')),
-    ('DOUBLECOLON', re.compile(r'::')),
-    # operators
-    ('DOUBLESLASH', re.compile(r'\/\/')),
-    ('SLASH', re.compile(r'\/')),
-    ('BAR', re.compile(r'\|')),
-    ('PLUS', re.compile(r'\+')),
-    ('MINUS', re.compile(r'-')),
-    ('EQ', re.compile(r'=')),
-    ('NEQ', re.compile(r'!=')),
-    ('LTE', re.compile(r'<=')),
-    ('GTE', re.compile(r'>=')),
-    ('GT', re.compile(r'>')),
-    ('LT', re.compile(r'<')),
-    ('STAR', re.compile(r'\*')),
-    # others
-    ('number', re.compile(r'[0-9]+(\.[0-9]+)?')),
-    ('prefix_test', re.compile(prefixteststr)),
-    ('name', re_ncname),
-    ('literal', re.compile(r'(\".*?\")|(\'.*?\')')),
-    ]
+two_char_starts = frozenset([t[0] for t in two_char_tokens])
+
+one_char_tokens = {
+    '(': 'LPAREN',
+    ')': 'RPAREN',
+    '[': 'LBRACKET',
+    ']': 'RBRACKET',
+    '.': 'DOT',
+    ',': 'COMMA',
+    '@': 'AT',
+    '$': 'DOLLAR',
+    '/': 'SLASH',
+    '|': 'BAR',
+    '+': 'PLUS',
+    '-': 'MINUS',
+    '=': 'EQ',
+    '>': 'GT',
+    '<': 'LT',
+    '*': 'STAR',
+}
+
+# everything else, i.e., literals and whitespace that is not handled
+# by _whitespace_chars, is matched by one regexp; the name of the
+# matching alternative is found in m.lastgroup
+re_token = re.compile(r'(?P<_whitespace>\s+)|'
+                      r'(?P<literal>(\".*?\")|(\'.*?\'))')
 
 operators = {
     'div': 'DIV',
@@ -90,88 +96,132 @@ operators = {
     'mod': 'MOD',
 }
 
-meta_tokens = ['node_type', 'axis', 'function_name', 'wildcard']
-
-node_types = [ 'comment', 'text', 'processing-instruction', 'node' ]
-axes = [ 'ancestor-or-self', 'ancestor', 'attribute', 'child',
-         'descendant-or-self', 'descendant', 'following-sibling',
-         'following', 'namespace', 'parent', 'preceding-sibling',
-         'preceding', 'self' ]
-
-def token_defs():
-    toks = [p[0] for p in patterns]
-    toks.extend(meta_tokens)
-    toks.extend([operators[op] for op in operators])
-    # remove spc
-    toks.remove('_whitespace')
-    return toks
+node_types = frozenset([ 'comment', 'text', 'processing-instruction',
+                         'node' ])
+axes = frozenset([ 'ancestor-or-self', 'ancestor', 'attribute', 'child',
+                   'descendant-or-self', 'descendant', 'following-sibling',
+                   'following', 'namespace', 'parent', 'preceding-sibling',
+                   'preceding', 'self' ])
+
+_name_start_chars = frozenset('abcdefghijklmnopqrstuvwxyz'
+                              'ABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+_digits = frozenset('0123456789')
+_whitespace_chars = frozenset(' \t\n\r')
+
+# the same names are used over and over again in the expressions in a
+# set of modules, so one string object is kept and shared per name.
+# (sys.intern can't be used since it doesn't accept unicode in Python 2)
+_names = {}
+_names_size = 4096
+
+def intern_name(v):
+    n = _names.get(v)
+    # in Python 2 a str and a unicode name are equal keys, but the
+    # caller gets back a string of the same type as it passed in
+    if n is None or type(n) is not type(v):
+        if len(_names) >= _names_size:
+            _names.clear()
+        _names[v] = n = v
+    return n
 
 re_open_para = re.compile(r'\s*\(')
 re_axis = re.compile(r'\s*::')
 
-def scan(s):
+def scan(s, keep_whitespace=True):
     """Return a list of tokens, or throw SyntaxError on failure.
+
+    Whitespace is returned as '_whitespace' tokens, unless
+    `keep_whitespace` is False.
     """
     line = 1
     linepos = 1
     pos = 0
     toks = []
     while pos < len(s):
-        matched = False
-        for tokname, r in patterns:
-            m = r.match(s, pos)
-            if m is not None:
+        v = s[pos]
+        tokname = None
+        if v in two_char_starts:
+            tokname = two_char_tokens.get(s[pos:pos + 2])
+            if tokname is not None:
+                v = s[pos:pos + 2]
+        if tokname is None:
+            tokname = one_char_tokens.get(v)
+        if tokname is None:
+            if v in _name_start_chars:
+                # a name, or a prefix_test 'prefix:*'
+                m = re_ncname.match(s, pos)
+                if m.group(2) is None and s.startswith(':*', m.end()):
+                    tokname = 'prefix_test'
+                    v = s[pos:m.end() + 2]
+                else:
+                    tokname = 'name'
+                    v = intern_name(m.group(0))
+            elif v in _digits:
+                tokname = 'number'
+                v = re_number.match(s, pos).group(0)
+            elif v in _whitespace_chars:
+                tokname = '_whitespace'
+                v = re_whitespace.match(s, pos).group(0)
+            else:
+                m = re_token.match(s, pos)
+                if m is None:
+                    # no patterns matched
+                    raise XPathError('syntax error', line, linepos)
                 # found a matching token
+                tokname = m.lastgroup
                 v = m.group(0)
-                prec = _preceding_token(toks)
-                if tokname == 'STAR' and prec is not None and _is_special(prec):
-                    # XPath 1.0 spec, 3.7 special rule 1a
-                    # interpret '*' as a wildcard
-                    tok = XPathTok('wildcard', v, line, linepos)
-                elif (tokname == 'name' and
-                      prec is not None and not _is_special(prec) and
-                      v in operators):
-                    # XPath 1.0 spec, 3.7 special rule 1b
-                    # interpret the name as an operator
-                    tok = XPathTok(operators[v], v, line, linepos)
-                elif tokname == 'name':
-                    # check if next token is '('
-                    if re_open_para.match(s, pos + len(v)):
-                        # XPath 1.0 spec, 3.7 special rule 2
-                        if v in node_types:
-                            # XPath 1.0 spec, 3.7 special rule 2a
-                            tok = XPathTok('node_type', v, line, linepos)
-                        else:
-                            # XPath 1.0 spec, 3.7 special rule 2b
-                            tok = XPathTok('function_name', v, line, linepos)
-                    # check if next token is '::'
-                    elif re_axis.match(s, pos + len(v)):
-                        # XPath 1.0 spec, 3.7 special rule 3
-                        if v in axes:
-                            tok = XPathTok('axis', v, line, linepos)
-                        else:
-                            e = "unknown axis %s" % v
-                            raise XPathError(e, line, linepos)
-                    else:
-                        tok = XPathTok('name', v, line, linepos)
+        if tokname == '_whitespace':
+            if keep_whitespace:
+                toks.append(XPathTok(tokname, v, line, linepos))
+            n = v.count('\n')
+            if n > 0:
+                line = line + n
+                linepos = len(v) - v.rfind('\n')
+            else:
+                linepos += len(v)
+            pos += len(v)
+            continue
+        # the preceding token is only needed to disambiguate '*' and
+        # operator names
+        prec = None
+        if tokname == 'STAR' or (tokname == 'name' and v in operators):
+            prec = _preceding_token(toks)
+        if tokname == 'STAR' and prec is not None and _is_special(prec):
+            # XPath 1.0 spec, 3.7 special rule 1a
+            # interpret '*' as a wildcard
+            tok = XPathTok('wildcard', v, line, linepos)
+        elif (tokname == 'name' and
+              prec is not None and not _is_special(prec) and
+              v in operators):
+            # XPath 1.0 spec, 3.7 special rule 1b
+            # interpret the name as an operator
+            tok = XPathTok(operators[v], v, line, linepos)
+        elif tokname == 'name':
+            # check if next token is '('
+            end = pos + len(v)
+            if s.startswith('(', end) or re_open_para.match(s, end):
+                # XPath 1.0 spec, 3.7 special rule 2
+                if v in node_types:
+                    # XPath 1.0 spec, 3.7 special rule 2a
+                    tok = XPathTok('node_type', v, line, linepos)
                 else:
-                    tok = XPathTok(tokname, v, line, linepos)
-                if tokname == '_whitespace':
-                    n = v.count('\n')
-                    if n > 0:
-                        line = line + n
-                        linepos = len(v) - v.rfind('\n')
-                    else:
-                        linepos += len(v)
+                    # XPath 1.0 spec, 3.7 special rule 2b
+                    tok = XPathTok('function_name', v, line, linepos)
+            # check if next token is '::'
+            elif s.startswith('::', end) or re_axis.match(s, end):
+                # XPath 1.0 spec, 3.7 special rule 3
+                if v in axes:
+                    tok = XPathTok('axis', v, line, linepos)
                 else:
-                    linepos += len(v)
-                pos += len(v)
-                toks.append(tok)
-                matched = True
-                break
-        if not matched:
-            # no patterns matched
-            raise XPathError('syntax error', line, linepos)
+                    e = "unknown axis %s" % v
+                    raise XPathError(e, line, linepos)
+            else:
+                tok = XPathTok('name', v, line, linepos)
+        else:
+            tok = XPathTok(tokname, v, line, linepos)
+        linepos += len(v)
+        pos += len(v)
+        toks.append(tok)
     return toks
 
 def _preceding_token(toks):
@@ -181,10 +231,10 @@ def _preceding_token(toks):
         return toks[-1]
     return None
 
-_special_tok_types = ['AT', 'DOUBLECOLON', 'LPAREN', 'LBRACKET',
-                      'SLASH', 'DOUBLESLASH', 'BAR', 'PLUS', 'MINUS',
-                      'EQ', 'NEQ', 'LT', 'LTE', 'GT', 'GTE',
-                      'AND', 'OR', 'MOD', 'DIV' ]
+_special_tok_types = frozenset(['AT', 'DOUBLECOLON', 'LPAREN', 'LBRACKET',
+                                'SLASH', 'DOUBLESLASH', 'BAR', 'PLUS',
+                                'MINUS', 'EQ', 'NEQ', 'LT', 'LTE', 'GT',
+                                'GTE', 'AND', 'OR', 'MOD', 'DIV' ])
 
 def _is_special(tok):
     return tok.type in _special_tok_types
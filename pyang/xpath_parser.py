@@ -1,16 +1,44 @@
 """XPath 1.0 parser
 
-PLY-based parser to build an AST for an XPath 1.0 expression.
+Recursive-descent parser to build an AST for an XPath 1.0 expression.
+
+The lexer resolves the ambiguities in the XPath grammar (see 3.7 in
+the spec), so one token of lookahead is enough to parse it.
 
 References are to rules in:
 http://www.w3.org/TR/1999/REC-xpath-19991116
 """
 
-from . import yacc
 from . import xpath_lexer
 
+# the same expressions tend to be used in many places, e.g., in
+# groupings, so parsed expressions are cached.  the ASTs are shared
+# between callers and must not be modified.
+_cache = {}
+_cache_size = 4096
+
+try:
+    _RecursionError = RecursionError
+except NameError:
+    # Python 2
+    _RecursionError = RuntimeError
+
 def parse(s):
-    return parser.parse(s, lexer = lexer, debug = False)
+    q = _cache.get(s)
+    if q is None:
+        try:
+            q = XPathParser(s).parse()
+        except _RecursionError:
+            # each level of nesting costs a few levels of recursion
+            raise xpath_lexer.XPathError("expression too deeply nested",
+                                         1, 1)
+        if len(_cache) >= _cache_size:
+            _cache.clear()
+        _cache[s] = q
+    return q
+
+def clear_cache():
+    _cache.clear()
 
 def pparse(s):
     try:
@@ -24,297 +52,253 @@ def pparse(s):
 
 ### Parser follows
 
-## [1]
-def p_location_path_1(p):
-    'LocationPath : RelativeLocationPath'
-    p[0] = ('relative', p[1])
-def p_location_path_2(p):
-    'LocationPath : AbsoluteLocationPath'
-    p[0] = ('absolute', p[1])
-
-## [2]
-def p_abs_location_path_1(p):
-    'AbsoluteLocationPath : SLASH RelativeLocationPath'
-    p[0] = p[2]
-def p_abs_location_path_2(p):
-    'AbsoluteLocationPath : SLASH'
-    p[0] = []
-def p_abs_location_path_3(p):
-    'AbsoluteLocationPath : AbbreviatedAbsoluteLocationPath'
-    p[0] = p[1]
-
-## [3]
-def p_rel_location_path_1(p):
-    'RelativeLocationPath : Step'
-    p[0] = [p[1]]
-def p_rel_location_path_2(p):
-    'RelativeLocationPath : RelativeLocationPath SLASH Step'
-    p[0] = list(p[1])
-    p[0].append(p[3])
-def p_rel_location_path_3(p):
-    'RelativeLocationPath : AbbreviatedRelativeLocationPath'
-    p[0] = p[1]
-
-## [4]
-def p_step_1(p):
-    'Step : axis DOUBLECOLON NodeTest PredicateList'
-    p[0] = ('step', p[1], p[3], p[4])
-def p_step_2(p):
-    'Step : axis DOUBLECOLON NodeTest'
-    p[0] = ('step', p[1], p[3], [])
-def p_step_3(p):
-    'Step : AT name PredicateList'
-    p[0] = ('step', 'attribute', p[2], p[3])
-def p_step_4(p):
-    'Step : AT name'
-    p[0] = ('step', 'attribute', p[2], [])
-def p_step_5(p):
-    'Step : NodeTest PredicateList'
-    p[0] = ('step', 'child', p[1], p[2])
-def p_step_6(p):
-    'Step : NodeTest'
-    p[0] = ('step', 'child', p[1], [])
-def p_step_7(p):
-    'Step : AbbreviatedStep PredicateList'
-    if p[1][1] == 'self':
-        a = "."
-        x = "self::node()"
-    else:
-        a = ".."
-        x = "parent::node()"
-    msg = "%s[<pred>] is illegal syntax.  use %s[<pred>] instead," % (a, x)
-    raise xpath_lexer.XPathError(msg, 1, 1)
-def p_step_8(p):
-    'Step : AbbreviatedStep'
-    p[0] = p[1]
-
-def p_pred_list_1(p):
-    'PredicateList : PredicateList Predicate'
-    p[0] = list(p[1])
-    p[0].append(p[2])
-def p_pred_list_2(p):
-    'PredicateList : Predicate'
-    p[0] = [p[1]]
-
-## [7]
-def p_node_test_1(p):
-    'NodeTest : NameTest'
-    p[0] = p[1]
-def p_node_test_2(p):
-    'NodeTest : node_type LPAREN RPAREN'
-    p[0] = ('node_type', p[1])
-def p_node_test_3(p):
-    'NodeTest : node_type LPAREN literal RPAREN'
-    if p[1] != 'processing-instruction':
-        raise SyntaxError
-    p[0] = ('processing-instruction', p[3])
-
-## [8]
-def p_pred(p):
-    'Predicate : LBRACKET PredicateExpr RBRACKET'
-    p[0] = p[2]
-
-## [9]
-def p_pred_expr(p):
-    'PredicateExpr : Expr'
-    p[0] = p[1]
-
-## [10]
-def p_abbrev_abs_loc_path(p):
-    'AbbreviatedAbsoluteLocationPath : DOUBLESLASH RelativeLocationPath'
-    p[0] = [_expand_double_slash()]
-    p[0].extend(p[2])
-
-## [11]
-def p_abbrev_rel_loc_path(p):
-    'AbbreviatedRelativeLocationPath : RelativeLocationPath DOUBLESLASH Step'
-    p[0] = list(p[1])
-    p[0].append(_expand_double_slash())
-    p[0].append(p[3])
-
-## [12]
-def p_abbrev_step_1(p):
-    'AbbreviatedStep : DOT'
-    p[0] = ('step', 'self', ('node_type', 'node'), [])
-def p_abbrev_step_2(p):
-    'AbbreviatedStep : DOTDOT'
-    p[0] = ('step', 'parent', ('node_type', 'node'), [])
-
-## [14]
-def p_expr(p):
-    'Expr : OrExpr'
-    p[0] = p[1]
-
-## [15]
-def p_prim_expr_1(p):
-    'PrimaryExpr : DOLLAR name'
-    p[0] = ('variable', p[2])
-def p_prim_expr_2(p):
-    'PrimaryExpr : LPAREN Expr RPAREN'
-    p[0] = p[2]
-def p_prim_expr_3(p):
-    'PrimaryExpr : literal'
-    p[0] = ('literal', p[1])
-def p_prim_expr_4(p):
-    'PrimaryExpr : number'
-    p[0] = ('number', p[1])
-def p_prim_expr_5(p):
-    'PrimaryExpr : FunctionCall'
-    p[0] = p[1]
-
-## [16]
-def p_fun_call_1(p):
-    'FunctionCall : function_name LPAREN RPAREN'
-    p[0] = ('function_call', p[1], [])
-def p_fun_call_2(p):
-    'FunctionCall : function_name LPAREN ArgumentList RPAREN'
-    p[0] = ('function_call', p[1], p[3])
-
-def p_arg_list_1(p):
-    'ArgumentList : ArgumentList COMMA Argument'
-    p[0] = list(p[1])
-    p[0].append(p[3])
-def p_arg_list_2(p):
-    'ArgumentList : Argument'
-    p[0] = [p[1]]
-
-## [17]
-def p_arg(p):
-    'Argument : Expr'
-    p[0] = p[1]
-
-## [18]
-def p_union_expr_1(p):
-    'UnionExpr : PathExpr'
-    p[0] = p[1]
-def p_union_expr_2(p):
-    'UnionExpr : UnionExpr BAR PathExpr'
-    p[0] = _mk_union(p[1], p[3])
-
-## [19]
-def p_path_expr_1(p):
-    'PathExpr : LocationPath'
-    p[0] = p[1]
-def p_path_expr_2(p):
-    'PathExpr : FilterExpr'
-    p[0] = ('path_expr', p[1])
-def p_path_expr_3(p):
-    'PathExpr : FilterExpr SLASH RelativeLocationPath'
-    p[0] = [p[1]]
-    p[0].extend(p[3])
-def p_path_expr_4(p):
-    'PathExpr : FilterExpr DOUBLESLASH RelativeLocationPath'
-    p[0] = [p[1]]
-    p[0].append(_expand_double_slash())
-    p[0].extend(p[3])
-
-## [20]
-def p_filter_expr_1(p):
-    'FilterExpr : PrimaryExpr'
-    p[0] = p[1]
-def p_filter_expr_2(p):
-    'FilterExpr : FilterExpr Predicate'
-    p[0] = ('path', 'filter', (p[1], p[2]))
-
-## [21]
-def p_or_expr_1(p):
-    'OrExpr : AndExpr'
-    p[0] = p[1]
-def p_or_expr_2(p):
-    'OrExpr : OrExpr OR AndExpr'
-    p[0] = ('bool', 'or', p[1], p[3])
-
-## [22]
-def p_and_expr_1(p):
-    'AndExpr : EqualityExpr'
-    p[0] = p[1]
-def p_and_expr_2(p):
-    'AndExpr : AndExpr AND EqualityExpr'
-    p[0] = ('bool', 'and', p[1], p[3])
-
-## [23]
-def p_eq_expr_1(p):
-    'EqualityExpr : RelationalExpr'
-    p[0] = p[1]
-def p_eq_expr_2(p):
-    'EqualityExpr : EqualityExpr EQ RelationalExpr'
-    p[0] = ('comp', '=', p[1], p[3])
-def p_eq_expr_3(p):
-    'EqualityExpr : EqualityExpr NEQ RelationalExpr'
-    p[0] = ('comp', '!=', p[1], p[3])
-
-##[24]
-def p_rel_expr_1(p):
-    'RelationalExpr : AdditiveExpr'
-    p[0] = p[1]
-def p_rel_expr_2(p):
-    'RelationalExpr : RelationalExpr LT AdditiveExpr'
-    p[0] = ('comp', '<', p[1], p[3])
-def p_rel_expr_3(p):
-    'RelationalExpr : RelationalExpr GT AdditiveExpr'
-    p[0] = ('comp', '>', p[1], p[3])
-def p_rel_expr_4(p):
-    'RelationalExpr : RelationalExpr LTE AdditiveExpr'
-    p[0] = ('comp', '<=', p[1], p[3])
-def p_rel_expr_5(p):
-    'RelationalExpr : RelationalExpr GTE AdditiveExpr'
-    p[0] = ('comp', '>=', p[1], p[3])
-
-## [25]
-def p_add_expr_1(p):
-    'AdditiveExpr : MultiplicativeExpr'
-    p[0] = p[1]
-def p_add_expr_2(p):
-    'AdditiveExpr : AdditiveExpr PLUS MultiplicativeExpr'
-    p[0] = ('arith', '+', p[1], p[3])
-def p_add_expr_3(p):
-    'AdditiveExpr : AdditiveExpr MINUS MultiplicativeExpr'
-    p[0] = ('arith', '-', p[1], p[3])
-
-## [26]
-def p_mul_expr_1(p):
-    'MultiplicativeExpr : UnaryExpr'
-    p[0] = p[1]
-def p_mul_expr_2(p):
-    'MultiplicativeExpr : MultiplicativeExpr MultiplyOperator UnaryExpr'
-    p[0] = ('arith', p[2], p[1], p[3])
-def p_mul_expr_3(p):
-    'MultiplicativeExpr : MultiplicativeExpr DIV UnaryExpr'
-    p[0] = ('arith', 'div', p[1], p[3])
-def p_mul_expr_4(p):
-    'MultiplicativeExpr : MultiplicativeExpr MOD UnaryExpr'
-    p[0] = ('arith', 'mod', p[1], p[3])
-
-## [27]
-def p_unary_expr_1(p):
-    'UnaryExpr : UnionExpr'
-    p[0] = p[1]
-def p_unary_expr_2(p):
-    'UnaryExpr : MINUS UnaryExpr %prec UMINUS'
-    p[0] = ('negative', p[2])
-
-## [34]
-def p_mul_oper(p):
-    'MultiplyOperator : STAR'
-    p[0] = '*'
-
-## [37]
-def p_name_test_1(p):
-    'NameTest : wildcard'
-    p[0] = 'wildcard'
-def p_name_test_2(p):
-    'NameTest : prefix_test'
-    p[0] = ('has_namespace', p[1])
-def p_name_test_3(p):
-    'NameTest : name'
-    p[0] = _mk_name(p[1])
-
-def p_error(tok):
-    if tok:
-        raise xpath_lexer.XPathError("syntax error before '%s'" % tok.value,
-                                     tok.lineno, tok.lexpos)
-    else:
-        raise SyntaxError("unexpected end of string")
+# tokens that can start a Step
+_step_start = frozenset(['axis', 'AT', 'DOT', 'DOTDOT',
+                         'wildcard', 'prefix_test', 'name', 'node_type'])
+
+# tokens that can start a FilterExpr
+_filter_start = frozenset(['DOLLAR', 'LPAREN', 'literal', 'number',
+                           'function_name'])
+
+# binary operators, mapped to (precedence, node, operator).  all of
+# them are left associative.
+_binary_ops = {
+    ## [21]
+    'OR': (0, 'bool', 'or'),
+    ## [22]
+    'AND': (1, 'bool', 'and'),
+    ## [23]
+    'EQ': (2, 'comp', '='),
+    'NEQ': (2, 'comp', '!='),
+    ## [24]
+    'LT': (3, 'comp', '<'),
+    'GT': (3, 'comp', '>'),
+    'LTE': (3, 'comp', '<='),
+    'GTE': (3, 'comp', '>='),
+    ## [25]
+    'PLUS': (4, 'arith', '+'),
+    'MINUS': (4, 'arith', '-'),
+    ## [26], [34]
+    'STAR': (5, 'arith', '*'),
+    'DIV': (5, 'arith', 'div'),
+    'MOD': (5, 'arith', 'mod'),
+}
+
+class XPathParser(object):
+    def __init__(self, s):
+        self.lexer = xpath_lexer.XPathLexer()
+        self.lexer.input(s)
+        self.tok = None
+        self.type = None
+        self._advance()
+
+    def parse(self):
+        q = self._expr()
+        if self.tok is not None:
+            self._error()
+        return q
+
+    def _advance(self):
+        """Consume the current token and return it."""
+        tok = self.tok
+        self.tok = self.lexer.token()
+        if self.tok is not None:
+            self.type = self.tok.type
+        else:
+            self.type = None
+        return tok
+
+    def _expect(self, toktype):
+        if self.type != toktype:
+            self._error()
+        return self._advance()
+
+    def _error(self):
+        tok = self.tok
+        if tok:
+            raise xpath_lexer.XPathError("syntax error before '%s'" %
+                                         tok.value, tok.lineno, tok.lexpos)
+        else:
+            raise SyntaxError("unexpected end of string")
+
+    ## [1]
+    def _location_path(self):
+        if self.type == 'SLASH':
+            ## [2]
+            self._advance()
+            if self.type in _step_start:
+                return ('absolute', self._relative_location_path([]))
+            return ('absolute', [])
+        elif self.type == 'DOUBLESLASH':
+            ## [10]
+            self._advance()
+            path = [_expand_double_slash()]
+            return ('absolute', self._relative_location_path(path))
+        else:
+            return ('relative', self._relative_location_path([]))
+
+    ## [3], [11]
+    def _relative_location_path(self, path):
+        """Parse steps, append them to `path` and return it."""
+        path.append(self._step())
+        while True:
+            if self.type == 'SLASH':
+                self._advance()
+            elif self.type == 'DOUBLESLASH':
+                self._advance()
+                path.append(_expand_double_slash())
+            else:
+                return path
+            path.append(self._step())
+
+    ## [4]
+    def _step(self):
+        if self.type == 'axis':
+            axis = self._advance().value
+            self._expect('DOUBLECOLON')
+            return ('step', axis, self._node_test(), self._predicate_list())
+        elif self.type == 'AT':
+            self._advance()
+            name = self._expect('name').value
+            return ('step', 'attribute', name, self._predicate_list())
+        elif self.type == 'DOT' or self.type == 'DOTDOT':
+            ## [12]
+            if self._advance().type == 'DOT':
+                a = "."
+                x = "self::node()"
+                step = ('step', 'self', ('node_type', 'node'), [])
+            else:
+                a = ".."
+                x = "parent::node()"
+                step = ('step', 'parent', ('node_type', 'node'), [])
+            if self.type == 'LBRACKET':
+                self._predicate_list()
+                msg = ("%s[<pred>] is illegal syntax.  use %s[<pred>] instead,"
+                       % (a, x))
+                raise xpath_lexer.XPathError(msg, 1, 1)
+            return step
+        else:
+            return ('step', 'child', self._node_test(), self._predicate_list())
+
+    def _predicate_list(self):
+        preds = []
+        while self.type == 'LBRACKET':
+            preds.append(self._predicate())
+        return preds
+
+    ## [7], [37]
+    def _node_test(self):
+        if self.type == 'wildcard':
+            self._advance()
+            return 'wildcard'
+        elif self.type == 'prefix_test':
+            return ('has_namespace', self._advance().value)
+        elif self.type == 'name':
+            return _mk_name(self._advance().value)
+        elif self.type == 'node_type':
+            node_type = self._advance().value
+            self._expect('LPAREN')
+            if (self.type == 'literal' and
+                node_type == 'processing-instruction'):
+                literal = self._advance().value
+                self._expect('RPAREN')
+                return ('processing-instruction', literal)
+            self._expect('RPAREN')
+            return ('node_type', node_type)
+        else:
+            self._error()
+
+    ## [8], [9]
+    def _predicate(self):
+        self._expect('LBRACKET')
+        q = self._expr()
+        self._expect('RBRACKET')
+        return q
+
+    ## [14], [21] - [26]
+    def _expr(self, prec=0):
+        """Parse an expression with operators of at least precedence
+        `prec`, using precedence climbing."""
+        q = self._unary_expr()
+        while self.type in _binary_ops:
+            (opprec, node, op) = _binary_ops[self.type]
+            if opprec < prec:
+                break
+            self._advance()
+            q = (node, op, q, self._expr(opprec + 1))
+        return q
+
+    ## [15]
+    def _primary_expr(self):
+        if self.type == 'DOLLAR':
+            self._advance()
+            return ('variable', self._expect('name').value)
+        elif self.type == 'LPAREN':
+            self._advance()
+            q = self._expr()
+            self._expect('RPAREN')
+            return q
+        elif self.type == 'literal':
+            return ('literal', self._advance().value)
+        elif self.type == 'number':
+            return ('number', self._advance().value)
+        else:
+            return self._function_call()
+
+    ## [16], [17]
+    def _function_call(self):
+        name = self._expect('function_name').value
+        self._expect('LPAREN')
+        args = []
+        if self.type != 'RPAREN':
+            args.append(self._expr())
+            while self.type == 'COMMA':
+                self._advance()
+                args.append(self._expr())
+        self._expect('RPAREN')
+        return ('function_call', name, args)
+
+    ## [18]
+    def _union_expr(self):
+        q = self._path_expr()
+        if self.type == 'BAR':
+            self._advance()
+            q = _mk_union(q, self._path_expr())
+            # q is now a union which is not yet shared with anyone,
+            # so the rest of the paths are added to it in place
+            while self.type == 'BAR':
+                self._advance()
+                _add_to_union(q, self._path_expr())
+        return q
+
+    ## [19]
+    def _path_expr(self):
+        if self.type not in _filter_start:
+            return self._location_path()
+        f = self._filter_expr()
+        if self.type == 'SLASH':
+            self._advance()
+            path = [f]
+        elif self.type == 'DOUBLESLASH':
+            self._advance()
+            path = [f, _expand_double_slash()]
+        else:
+            return ('path_expr', f)
+        return self._relative_location_path(path)
+
+    ## [20]
+    def _filter_expr(self):
+        q = self._primary_expr()
+        while self.type == 'LBRACKET':
+            q = ('path', 'filter', (q, self._predicate()))
+        return q
+
+    ## [27]
+    def _unary_expr(self):
+        if self.type == 'MINUS':
+            self._advance()
+            return ('negative', self._unary_expr())
+        return self._union_expr()
 
 def _mk_union(a, b):
     if a[0] == 'union' and b[0] == 'union':
@@ -323,35 +307,28 @@ def _mk_union(a, b):
         return ('union', v)
     elif a[0] == 'union':
         v = list(a[1])
-        v.append(b[1])
+        v.append(b)
         return ('union', v)
     elif b[0] == 'union':
-        v = [b]
-        v.extend(a[1])
+        v = [a]
+        v.extend(b[1])
         return ('union', v)
     else:
         return ('union', [a, b])
 
+def _add_to_union(u, b):
+    if b[0] == 'union':
+        u[1].extend(b[1])
+    else:
+        u[1].append(b)
+
 def _expand_double_slash():
     return ('step', 'descendant-or-self', ('node_type', 'node'), [])
 
 def _mk_name(v):
     m = xpath_lexer.re_ncname.match(v)
     if m.group(2) is not None:
-        return ('name', m.group(2), m.group(3))
+        return ('name', xpath_lexer.intern_name(m.group(2)),
+                xpath_lexer.intern_name(m.group(3)))
     else:
         return ('name', None, v)
-
-start = 'Expr'
-
-precedence = (
-    ('left', 'OR'),
-    ('left', 'AND'),
-    ('left', 'EQ', 'NEQ'),
-    ('left', 'LT', 'LTE', 'GT', 'GTE'),
-    ('right', 'UMINUS'), # Unary minus operator
-)
-
-tokens = xpath_lexer.token_defs()
-lexer = xpath_lexer.XPathLexer()
-parser = yacc.yacc(tabmodule="xpath_parsetab", debug=False)
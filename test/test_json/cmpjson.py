@@ -2,7 +2,6 @@
 
 # This program compares two JSON files given as parameters
 
-import codecs
 import sys
 import json
 
@@ -10,14 +9,21 @@ if len(sys.argv) != 3:
     sys.stderr.write("Usage: cmpjson.py json_file_1 json_file_2\n")
     sys.exit(1)
 
-fa = codecs.open(sys.argv[1], encoding="utf-8")
-fb = codecs.open(sys.argv[2], encoding="utf-8")
+with open(sys.argv[1], "rb") as fa:
+    da = fa.read()
+with open(sys.argv[2], "rb") as fb:
+    db = fb.read()
 
-a = json.load(fa)
-b = json.load(fb)
+# identical files are equal JSON documents, but they must still be
+# valid JSON; only parse the second file if they differ, e.g., in
+# formatting or member order
+a = json.loads(da.decode("utf-8"))
+if da != db:
+    b = json.loads(db.decode("utf-8"))
 
-if a != b:
-    sys.stderr.write("JSON documents from %s and %s differ.\n" % tuple(sys.argv[1:3]))
-    sys.exit(2)
+    if a != b:
+        sys.stderr.write("JSON documents from %s and %s differ.\n" %
+                         tuple(sys.argv[1:3]))
+        sys.exit(2)
 
 sys.exit(0)
@@ -0,0 +1,24 @@
+#! /usr/bin/env python
+
+# This program prints the AST for each XPath expression in a file,
+# one expression per line
+
+import sys
+
+from pyang import xpath_lexer
+from pyang import xpath_parser
+
+if len(sys.argv) != 2:
+    sys.stderr.write("Usage: xpath_ast.py file\n")
+    sys.exit(1)
+
+with open(sys.argv[1]) as f:
+    for line in f:
+        s = line.rstrip('\n')
+        try:
+            r = repr(xpath_parser.parse(s))
+        except xpath_lexer.XPathError as e:
+            r = 'error: %s' % e.msg
+        except SyntaxError as e:
+            r = 'error: %s' % e.msg
+        sys.stdout.write('%s\n    %s\n' % (s, r))